@@ -1,61 +1,147 @@
 #!/usr/bin/env python3
-import json
+import heapq
 import sys
-from typing import Any, Set
+from typing import Any, FrozenSet, Iterator, List, Set, Tuple
 
-def analyze_schema(value: Any, seen_types: Set[str] = None, depth: int = 0) -> str:
+try:
+    import ijson
+    JSONError = ijson.JSONError
+except ImportError:
+    # Without ijson, parse the whole file instead of streaming it
+    ijson = None
+    try:
+        import orjson
+        JSONError = orjson.JSONDecodeError
+    except ImportError:
+        import json
+        orjson = None
+        JSONError = json.JSONDecodeError
+
+def close_dict(value: dict, parts: List[str], depth: int) -> str:
+    """Join the schema lines of a dict's sample keys"""
+    indent = "  " * depth
+    if len(value) > 20:
+        parts.append(f"{indent}  ... ({len(value)-20} more fields)")
+
+    return "{\n" + "\n".join(parts) + f"\n{indent}" + "}"
+
+def analyze_schema(value: Any, seen_types: Set[FrozenSet[str]] = None, depth: int = 0) -> str:
     """Create a simplified schema representation"""
     if seen_types is None:
         seen_types = set()
 
-    indent = "  " * depth
+    # Walk depth-first with an explicit stack of open containers:
+    # (depth, None) for arrays, (depth, dict, sample_keys, parts) for dicts
+    stack = []
+    while True:
+        if value is None:
+            schema = "null"
+        elif isinstance(value, (bool, int, float, str)):
+            schema = type(value).__name__
+        elif isinstance(value, list):
+            if value:
+                # Only analyze first item in array
+                stack.append((depth, None))
+                value, depth = value[0], depth + 1
+                continue
+            schema = "[]"
+        elif isinstance(value, dict):
+            # The key set identifies the shape, no need to sort it first
+            type_key = frozenset(value)
+            if type_key in seen_types:
+                schema = "{...}" # Show recursion simply
+            else:
+                seen_types.add(type_key)
+
+                # Show just a few key examples
+                sample_keys = heapq.nsmallest(20, value)
+                if sample_keys:
+                    stack.append((depth, value, sample_keys, []))
+                    value, depth = value[sample_keys[0]], depth + 1
+                    continue
+                schema = close_dict(value, [], depth)
+        else:
+            schema = "unknown"
+
+        # Hand the finished schema up to the open containers
+        while stack:
+            frame = stack[-1]
+            if frame[1] is None:
+                stack.pop()
+                schema = f"Array<{schema}>"
+                continue
 
-    if value is None:
-        return "null"
-    elif isinstance(value, (bool, int, float, str)):
-        return type(value).__name__
-    elif isinstance(value, list):
-        if not value:
-            return "[]"
+            frame_depth, obj, sample_keys, parts = frame
+            parts.append(f"{'  ' * frame_depth}  {sample_keys[len(parts)]}: {schema}")
+            if len(parts) < len(sample_keys):
+                value, depth = obj[sample_keys[len(parts)]], frame_depth + 1
+                break
 
-        # Only analyze first item in array
-        type_str = analyze_schema(value[0], seen_types, depth + 1)
-        return f"Array<{type_str}>"
+            stack.pop()
+            schema = close_dict(obj, parts, frame_depth)
+        else:
+            return schema
 
-    elif isinstance(value, dict):
-        type_key = f"dict{tuple(sorted(value.keys()))}"
-        if type_key in seen_types:
-            return "{...}" # Show recursion simply
+def skip_value(events: Iterator[Tuple[str, Any]], event: str):
+    """Consume the remaining events of a value without building it"""
+    depth = 1 if event in ('start_map', 'start_array') else 0
+    while depth:
+        event, _ = next(events)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
 
-        seen_types.add(type_key)
+def build_sample(events: Iterator[Tuple[str, Any]], event: str, value: Any) -> Any:
+    """Build a value from parse events, keeping only the first item of each array"""
+    if event == 'start_map':
+        obj = {}
+        for event, key in events:
+            if event == 'end_map':
+                return obj
+            event, value = next(events)
+            obj[key] = build_sample(events, event, value)
+    elif event == 'start_array':
+        items = []
+        for event, value in events:
+            if event == 'end_array':
+                return items
+            if items:
+                skip_value(events, event)
+            else:
+                items.append(build_sample(events, event, value))
+    return value
 
-        # Show just a few key examples
-        sample_keys = sorted(value.keys())[:20]
-        parts = []
-        for key in sample_keys:
-            val_schema = analyze_schema(value[key], seen_types, depth + 1)
-            parts.append(f"{indent}  {key}: {val_schema}")
+def load_sample(f) -> Any:
+    """Stream a JSON file into the sample analyze_schema needs"""
+    if ijson is None:
+        if orjson is not None:
+            return orjson.loads(f.read())
+        return json.loads(f.read())
 
-        if len(value) > 20:
-            parts.append(f"{indent}  ... ({len(value)-20} more fields)")
+    events = ijson.basic_parse(f, use_float=True)
+    event, value = next(events)
+    sample = build_sample(events, event, value)
 
-        return "{\n" + "\n".join(parts) + f"\n{indent}" + "}"
+    # Read past the top-level value so trailing garbage is still reported as invalid
+    for event, _ in events:
+        raise JSONError(f"Extra data after the top-level value ({event})")
 
-    return "unknown"
+    return sample
 
 def print_schema(filename: str):
     """Load JSON file and print its simplified schema"""
     try:
-        with open(filename, 'r') as f:
+        with open(filename, 'rb') as f:
             print(f"\nSchema for {filename}:")
             print("=" * 40)
-            data = json.load(f)
+            data = load_sample(f)
             schema = analyze_schema(data)
             print(schema)
 
     except FileNotFoundError:
         print(f"Error: File {filename} not found")
-    except json.JSONDecodeError as e:
+    except JSONError as e:
         print(f"Error: Invalid JSON: {e}")
     except Exception as e:
         print(f"Error: {e}")
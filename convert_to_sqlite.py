@@ -1,206 +1,324 @@
 #!/usr/bin/env python3
-import json
 import sqlite3
 from pathlib import Path
 
+import ijson
+
+# Number of games buffered before each executemany()
+BATCH_SIZE = 5000
+
+# Number of games after which the already-queued pair sets are dropped
+SEEN_RESET_INTERVAL = 50000
+
+# Upserts update rows in place instead of REPLACE's delete + reinsert
+INSERT_SYSTEM_SQL = """
+    INSERT INTO systems (id, name, alias)
+    VALUES (?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        name = excluded.name,
+        alias = excluded.alias
+"""
+
+INSERT_GAME_SQL = """
+    INSERT INTO games (
+        id, game_title, release_date, platform, region_id,
+        country_id, overview, youtube, players, coop, rating
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        game_title = excluded.game_title,
+        release_date = excluded.release_date,
+        platform = excluded.platform,
+        region_id = excluded.region_id,
+        country_id = excluded.country_id,
+        overview = excluded.overview,
+        youtube = excluded.youtube,
+        players = excluded.players,
+        coop = excluded.coop,
+        rating = excluded.rating
+"""
+
+# Nullable games columns, in the order INSERT_GAME_SQL binds them after id and game_title
+GAME_OPTIONAL_FIELDS = (
+    'release_date', 'platform', 'region_id', 'country_id', 'overview',
+    'youtube', 'players', 'coop', 'rating'
+)
+
+INSERT_DEVELOPER_SQL = "INSERT OR IGNORE INTO game_developers (game_id, developer_id) VALUES (?, ?)"
+INSERT_GENRE_SQL = "INSERT OR IGNORE INTO game_genres (game_id, genre_id) VALUES (?, ?)"
+INSERT_PUBLISHER_SQL = "INSERT OR IGNORE INTO game_publishers (game_id, publisher_id) VALUES (?, ?)"
+INSERT_ALTERNATE_SQL = "INSERT OR IGNORE INTO game_alternates (game_id, alternate_title) VALUES (?, ?)"
+
+INSERT_ARTWORK_SQL = """
+    INSERT INTO game_artwork (id, game_id, type, side, filename, resolution)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        game_id = excluded.game_id,
+        type = excluded.type,
+        side = excluded.side,
+        filename = excluded.filename,
+        resolution = excluded.resolution
+"""
+
+SCHEMA_SQL = """
+    -- Platforms/Systems table
+    CREATE TABLE IF NOT EXISTS systems (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        alias TEXT
+    );
+
+    -- Main games table
+    CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        game_title TEXT NOT NULL,
+        release_date TEXT,
+        platform INTEGER,
+        region_id INTEGER,
+        country_id INTEGER,
+        overview TEXT,
+        youtube TEXT,
+        players INTEGER,
+        coop TEXT,
+        rating TEXT,
+        FOREIGN KEY (platform) REFERENCES systems(id)
+    );
+
+    -- Many-to-many relationship tables
+    CREATE TABLE IF NOT EXISTS game_developers (
+        game_id INTEGER,
+        developer_id INTEGER,
+        PRIMARY KEY (game_id, developer_id),
+        FOREIGN KEY (game_id) REFERENCES games(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS game_genres (
+        game_id INTEGER,
+        genre_id INTEGER,
+        PRIMARY KEY (game_id, genre_id),
+        FOREIGN KEY (game_id) REFERENCES games(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS game_publishers (
+        game_id INTEGER,
+        publisher_id INTEGER,
+        PRIMARY KEY (game_id, publisher_id),
+        FOREIGN KEY (game_id) REFERENCES games(id)
+    );
+
+    -- Alternate titles
+    CREATE TABLE IF NOT EXISTS game_alternates (
+        game_id INTEGER,
+        alternate_title TEXT,
+        PRIMARY KEY (game_id, alternate_title),
+        FOREIGN KEY (game_id) REFERENCES games(id)
+    );
+
+    -- Artwork table
+    CREATE TABLE IF NOT EXISTS game_artwork (
+        id INTEGER PRIMARY KEY,
+        game_id INTEGER,
+        type TEXT,
+        side TEXT,
+        filename TEXT,
+        resolution TEXT,
+        FOREIGN KEY (game_id) REFERENCES games(id)
+    );
+"""
+
+# Built after the bulk import so inserts don't have to maintain them
+INDEX_SQL = """
+    -- Create indexes for better search performance
+    CREATE INDEX IF NOT EXISTS idx_games_title ON games(game_title);
+    CREATE INDEX IF NOT EXISTS idx_games_platform ON games(platform);
+    CREATE INDEX IF NOT EXISTS idx_systems_name ON systems(name);
+"""
+
 def create_database(db_path: str):
     """Create SQLite database with proper schema"""
-    conn = sqlite3.connect(db_path)
+    # Transactions are managed explicitly with BEGIN/COMMIT in import_data
+    conn = sqlite3.connect(db_path, isolation_level=None)
     c = conn.cursor()
 
+    # Tune for a one-off bulk load; main() switches back to a rollback journal
+    # once it's done. WAL with synchronous=NORMAL only syncs at checkpoints
+    # but still can't be corrupted by a crash mid-build.
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA cache_size=-262144")
+    c.execute("PRAGMA mmap_size=268435456")
+    c.execute("PRAGMA locking_mode=EXCLUSIVE")
+
     # Create tables based on the schema we found
-    c.executescript("""
-        -- Platforms/Systems table
-        CREATE TABLE IF NOT EXISTS systems (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            alias TEXT
-        );
-
-        -- Main games table
-        CREATE TABLE IF NOT EXISTS games (
-            id INTEGER PRIMARY KEY,
-            game_title TEXT NOT NULL,
-            release_date TEXT,
-            platform INTEGER,
-            region_id INTEGER,
-            country_id INTEGER,
-            overview TEXT,
-            youtube TEXT,
-            players INTEGER,
-            coop TEXT,
-            rating TEXT,
-            FOREIGN KEY (platform) REFERENCES systems(id)
-        );
-
-        -- Many-to-many relationship tables
-        CREATE TABLE IF NOT EXISTS game_developers (
-            game_id INTEGER,
-            developer_id INTEGER,
-            PRIMARY KEY (game_id, developer_id),
-            FOREIGN KEY (game_id) REFERENCES games(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS game_genres (
-            game_id INTEGER,
-            genre_id INTEGER,
-            PRIMARY KEY (game_id, genre_id),
-            FOREIGN KEY (game_id) REFERENCES games(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS game_publishers (
-            game_id INTEGER,
-            publisher_id INTEGER,
-            PRIMARY KEY (game_id, publisher_id),
-            FOREIGN KEY (game_id) REFERENCES games(id)
-        );
-
-        -- Alternate titles
-        CREATE TABLE IF NOT EXISTS game_alternates (
-            game_id INTEGER,
-            alternate_title TEXT,
-            PRIMARY KEY (game_id, alternate_title),
-            FOREIGN KEY (game_id) REFERENCES games(id)
-        );
-
-        -- Artwork table
-        CREATE TABLE IF NOT EXISTS game_artwork (
-            id INTEGER PRIMARY KEY,
-            game_id INTEGER,
-            type TEXT,
-            side TEXT,
-            filename TEXT,
-            resolution TEXT,
-            FOREIGN KEY (game_id) REFERENCES games(id)
-        );
-
-        -- Create indexes for better search performance
-        CREATE INDEX IF NOT EXISTS idx_games_title ON games(game_title);
-        CREATE INDEX IF NOT EXISTS idx_games_platform ON games(platform);
-        CREATE INDEX IF NOT EXISTS idx_systems_name ON systems(name);
-    """)
+    c.executescript(SCHEMA_SQL)
 
     conn.commit()
     return conn
 
-def safe_insert_many(cursor, sql, data):
-    """Insert many records, skipping duplicates"""
-    for item in data:
+def create_indexes(conn: sqlite3.Connection):
+    """Create search indexes and gather statistics for the query planner"""
+    c = conn.cursor()
+    c.executescript(INDEX_SQL)
+    c.execute("ANALYZE")
+
+def insert_batches(cursor, batches):
+    """Insert each pending batch of rows and clear it, dropping only the rows SQLite rejects
+
+    Each batch is (sql, rows, label), where label is formatted with a rejected
+    row's values to say what was skipped. Returns the number of rows dropped.
+    """
+    dropped = 0
+    for sql, rows, label in batches:
         try:
-            cursor.execute(sql, item)
-        except sqlite3.IntegrityError as e:
-            if "UNIQUE constraint failed" in str(e):
-                continue  # Skip duplicates
-            else:
-                raise  # Re-raise other integrity errors
+            cursor.executemany(sql, rows)
+        except sqlite3.Error:
+            # Redo the batch one row at a time; every statement is an upsert or
+            # INSERT OR IGNORE, so rows that already went in are simply rewritten
+            for row in rows:
+                try:
+                    cursor.execute(sql, row)
+                except sqlite3.Error as e:
+                    print(f"Error importing {label.format(*row)}: {e}")
+                    dropped += 1
+        rows.clear()
+
+    return dropped
+
+def queue_new_pairs(rows, seen, game_id, child_ids):
+    """Queue (game_id, child_id) pairs that haven't been queued yet"""
+    for child_id in child_ids:
+        pair = (game_id, child_id)
+        if pair not in seen:
+            seen.add(pair)
+            rows.append(pair)
+
+def iter_items(json_path: str, prefix: str):
+    """Stream the items found under `prefix` without loading the whole file"""
+    with open(json_path, 'rb') as f:
+        yield from ijson.items(f, prefix, use_float=True)
+
+def iter_kvitems(json_path: str, prefix: str):
+    """Stream the key/value pairs of the object found under `prefix`"""
+    with open(json_path, 'rb') as f:
+        yield from ijson.kvitems(f, prefix, use_float=True)
+
+def iter_artwork_rows(json_path: str):
+    """Yield game_artwork rows from the streamed boxart data"""
+    for game_id, artworks in iter_kvitems(json_path, 'include.boxart.data'):
+        for art in artworks:
+            try:
+                # Rows are upserted on the TGDB id; an auto-assigned rowid could
+                # collide with a later entry's id and overwrite its row
+                art_id = art['id']
+                if art_id is None:
+                    raise ValueError("id is null")
+                row = (
+                    art_id, int(game_id), art['type'], art.get('side'),
+                    art['filename'], art.get('resolution')
+                )
+            except Exception as e:
+                print(f"Error importing artwork for game {game_id}: {e}")
+                continue
+
+            yield row
 
 def import_data(conn: sqlite3.Connection, json_path: str):
     """Import data from JSON file into SQLite database"""
-    with open(json_path) as f:
-        data = json.load(f)
-
     c = conn.cursor()
 
-    # Import platforms/systems first
-    if 'include' in data and 'platform' in data['include']:
+    # Run the whole import in a single transaction
+    c.execute("BEGIN")
+    with conn:
+        # Import platforms/systems first
         print("Importing platforms...")
-        platforms = data['include']['platform']['data']
-        for platform_id, platform_data in platforms.items():
+        platform_rows = []
+        for platform_id, platform_data in iter_kvitems(json_path, 'include.platform.data'):
             try:
-                c.execute("""
-                    INSERT OR REPLACE INTO systems (id, name, alias)
-                    VALUES (?, ?, ?)
-                """, (
-                    platform_data['id'],
-                    platform_data['name'],
-                    platform_data.get('alias')
-                ))
+                name = platform_data['name']
+                if name is None:
+                    raise ValueError("name is null")
+                platform_rows.append((platform_data['id'], name, platform_data.get('alias')))
             except Exception as e:
                 print(f"Error importing platform {platform_id}: {e}")
 
-        print(f"Imported {len(platforms)} platforms")
-        conn.commit()
-
-    total_games = len(data['data']['games'])
-    print(f"Found {total_games} games to import")
-
-    # Use a transaction for better performance
-    with conn:
-        for i, game in enumerate(data['data']['games'], 1):
-            if i % 1000 == 0:
-                print(f"Processing game {i}/{total_games}...")
+        platform_count = len(platform_rows)
+        platform_count -= insert_batches(c, ((INSERT_SYSTEM_SQL, platform_rows, "platform {0}"),))
+        print(f"Imported {platform_count} platforms")
+
+        game_rows = []
+        developer_rows = []
+        genre_rows = []
+        publisher_rows = []
+        alternate_rows = []
+        game_batches = (
+            (INSERT_GAME_SQL, game_rows, "game {0} ({1})"),
+            (INSERT_DEVELOPER_SQL, developer_rows, "developer {1} for game {0}"),
+            (INSERT_GENRE_SQL, genre_rows, "genre {1} for game {0}"),
+            (INSERT_PUBLISHER_SQL, publisher_rows, "publisher {1} for game {0}"),
+            (INSERT_ALTERNATE_SQL, alternate_rows, "alternate title {1!r} for game {0}"),
+        )
+
+        seen_developers = set()
+        seen_genres = set()
+        seen_publishers = set()
+        seen_alternates = set()
+        seen_pairs = (seen_developers, seen_genres, seen_publishers, seen_alternates)
+
+        total_games = 0
+        for total_games, game in enumerate(iter_items(json_path, 'data.games.item'), 1):
+            try:
+                game_id = game['id']
+                game_title = game['game_title']
+                if game_title is None:
+                    raise ValueError("game_title is null")
+                game_rows.append((game_id, game_title, *map(game.get, GAME_OPTIONAL_FIELDS)))
+            except Exception as e:
+                print(f"Error processing game {game.get('id')} ({game.get('game_title')}): {e}")
+                continue
 
             try:
-                # Insert main game data
-                c.execute("""
-                    INSERT OR REPLACE INTO games (
-                        id, game_title, release_date, platform, region_id,
-                        country_id, overview, youtube, players, coop, rating
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    game['id'], game['game_title'], game.get('release_date'),
-                    game.get('platform'), game.get('region_id'), game.get('country_id'),
-                    game.get('overview'), game.get('youtube'), game.get('players'),
-                    game.get('coop'), game.get('rating')
-                ))
-
-                # Insert developers
+                # Skip pairs already queued so SQLite never sees the duplicates
                 if game.get('developers'):
-                    safe_insert_many(
-                        c,
-                        "INSERT OR IGNORE INTO game_developers (game_id, developer_id) VALUES (?, ?)",
-                        [(game['id'], dev_id) for dev_id in game['developers']]
-                    )
+                    queue_new_pairs(developer_rows, seen_developers, game_id, game['developers'])
 
-                # Insert genres
                 if game.get('genres'):
-                    safe_insert_many(
-                        c,
-                        "INSERT OR IGNORE INTO game_genres (game_id, genre_id) VALUES (?, ?)",
-                        [(game['id'], genre_id) for genre_id in game['genres']]
-                    )
+                    queue_new_pairs(genre_rows, seen_genres, game_id, game['genres'])
 
-                # Insert publishers
                 if game.get('publishers'):
-                    safe_insert_many(
-                        c,
-                        "INSERT OR IGNORE INTO game_publishers (game_id, publisher_id) VALUES (?, ?)",
-                        [(game['id'], pub_id) for pub_id in game['publishers']]
-                    )
+                    queue_new_pairs(publisher_rows, seen_publishers, game_id, game['publishers'])
 
-                # Insert alternates
                 if game.get('alternates'):
-                    # Filter out None/null values and ensure uniqueness
-                    alternates = list(set(alt for alt in game['alternates'] if alt))
-                    safe_insert_many(
-                        c,
-                        "INSERT OR IGNORE INTO game_alternates (game_id, alternate_title) VALUES (?, ?)",
-                        [(game['id'], alt) for alt in alternates]
-                    )
-
+                    # Filter out None/null values
+                    alternates = (alt for alt in game['alternates'] if alt)
+                    queue_new_pairs(alternate_rows, seen_alternates, game_id, alternates)
             except Exception as e:
-                print(f"Error processing game {game['id']} ({game['game_title']}): {e}")
-
-        # Import artwork if available
-        if 'include' in data and 'boxart' in data['include']:
-            print("Importing artwork...")
-            artwork_count = 0
-
-            for game_id, artworks in data['include']['boxart']['data'].items():
-                for art in artworks:
-                    try:
-                        c.execute("""
-                            INSERT OR REPLACE INTO game_artwork (game_id, type, side, filename, resolution)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (
-                            int(game_id), art['type'], art.get('side'),
-                            art['filename'], art.get('resolution')
-                        ))
-                        artwork_count += 1
-                    except Exception as e:
-                        print(f"Error importing artwork for game {game_id}: {e}")
-
-            print(f"Imported {artwork_count} artwork entries")
+                print(f"Error processing game {game_id} ({game_title}): {e}")
+
+            if total_games % BATCH_SIZE == 0:
+                print(f"Processing game {total_games}...")
+                insert_batches(c, game_batches)
+
+            if total_games % SEEN_RESET_INTERVAL == 0:
+                for seen in seen_pairs:
+                    seen.clear()
+
+        insert_batches(c, game_batches)
+        print(f"Processed {total_games} games")
+
+        # Import artwork if available, streamed in batches like the games
+        print("Importing artwork...")
+        artwork_rows = []
+        artwork_batches = ((INSERT_ARTWORK_SQL, artwork_rows, "artwork {0} for game {1}"),)
+        artwork_count = 0
+        for row in iter_artwork_rows(json_path):
+            artwork_rows.append(row)
+            if len(artwork_rows) == BATCH_SIZE:
+                artwork_count += BATCH_SIZE
+                artwork_count -= insert_batches(c, artwork_batches)
+
+        artwork_count += len(artwork_rows)
+        artwork_count -= insert_batches(c, artwork_batches)
+        print(f"Imported {artwork_count} artwork entries")
 
 def main():
     json_path = 'database-latest.json'
@@ -212,6 +330,13 @@ def main():
     print(f"Importing data from {json_path}...")
     import_data(conn, json_path)
 
+    print("Creating indexes...")
+    create_indexes(conn)
+
+    # Checkpoint and leave WAL so the shipped file is a single self-contained
+    # database that opens read-only without -wal/-shm files next to it
+    conn.execute("PRAGMA journal_mode=DELETE")
+
     # Print some stats
     c = conn.cursor()
     c.execute("SELECT COUNT(*) FROM games")
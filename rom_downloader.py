@@ -2,10 +2,13 @@ import argparse
 import json
 import sqlite3
 import os
+import shutil
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 from tqdm import tqdm
-import time
+import threading
 from difflib import get_close_matches
 import concurrent.futures
 from functools import partial
@@ -13,11 +16,67 @@ import re
 
 GAMESDB_CDN = "https://cdn.thegamesdb.net/"
 
+# Download threads, and how many of them may talk to the CDN at once
+MAX_WORKERS = 16
+MAX_IN_FLIGHT = 8
+
+# Read/write size used when copying a response body to disk
+COPY_BUFFER_SIZE = 1 << 20
+
+# (connect, read) timeouts in seconds, so a stalled download gives up its request slot
+REQUEST_TIMEOUT = (10, 60)
+
+# Artwork formats picked up by scan_roms.py; any of them counts as already downloaded
+ARTWORK_FORMATS = ['.jpg', '.jpeg', '.png']
+
+# Platform-specific suffixes stripped from ROM names before searching
+_PLATFORM_SUFFIXES = [
+    '-latest',
+    'by MooglyGuy (PD)',
+    '_Win64',
+    '(Nintendo, Wide Screen)',
+    '(VTech, Time & Fun)',
+    '(Gakken, LCD Card Game)',
+    '(Tomytronic)',
+    '(Nintendo, Panorama Screen)',
+    '(Nintendo, Table Top)',
+    '(Mattel Electronics)',
+    '(VTech, Electronic Tini-Arcade)',
+    '(VTech, Sporty Time & Fun)',
+    '(VTech, Explorer Time & Fun)',
+    '(Bandai, LSI Game Double Play)'
+]
+
+# Compiled once, these run for every ROM name
+_RE_PAREN = re.compile(r'\([^)]*\)')
+_RE_TRAIL_PAREN = re.compile(r'\s*\([^)]*\)\s*$')
+_RE_CAMEL = re.compile(r'([a-z])([A-Z])')
+_RE_SUFFIXES = re.compile('|'.join(re.escape(suffix) for suffix in _PLATFORM_SUFFIXES))
+
 class ROMDownloader:
     def __init__(self, artwork_only=False):
         self.artwork_only = artwork_only
-        self.db_conn = sqlite3.connect('games.db')
+        # The database is only read here, so skip locking and journal checks. Queries
+        # all run on the main thread, but after Ctrl-C the last reference (and so
+        # __del__'s close) can be dropped by a download thread that is still running.
+        self.db_conn = sqlite3.connect('file:games.db?mode=ro&immutable=1', uri=True,
+                                       check_same_thread=False)
         self.db_conn.row_factory = sqlite3.Row
+        self.db_conn.execute("PRAGMA mmap_size=1073741824")
+        self.db_conn.execute("PRAGMA cache_size=-65536")
+
+        # Reused for the per-game artwork queries
+        self.cursor = self.db_conn.cursor()
+
+        # One keep-alive session shared by all download threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=2 * MAX_WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.request_slots = threading.Semaphore(MAX_IN_FLIGHT)
+
+        # System folder -> names of the files already in it
+        self.existing_files = {}
 
         # Load assets.cores.json
         try:
@@ -30,6 +89,9 @@ class ROMDownloader:
         # Build system mapping
         self.system_mapping = self.get_system_mapping()
 
+        # Load game titles once instead of querying per ROM
+        self.title_index = self.get_title_index()
+
     def get_system_mapping(self):
         """Get mapping between system names and their IDs from the database"""
         cursor = self.db_conn.cursor()
@@ -105,112 +167,124 @@ class ROMDownloader:
             "Handheld Electronic Game": ["Handheld Electronic Games (LCD)", "lcd-games"]
         }
 
+        # Index database systems by lowercased name and by alias once
+        by_name = {}
+        by_alias = {}
+        for db_system in db_systems:
+            by_name.setdefault(db_system['name'].lower(), db_system)
+            if db_system['alias']:
+                by_alias.setdefault(db_system['alias'], db_system)
+        db_system_names = list(by_name)
+
         # First try to map the systems we know about
         for system in self.cores_data:
             system_name = system['name']
-            found = False
+            db_system = None
 
             # Try name variations first
-            if system_name in name_variations:
-                variations = name_variations[system_name]
-                for db_system in db_systems:
-                    if db_system['name'].lower() in [v.lower() for v in variations] or \
-                       db_system['alias'] in variations:
-                        mapping[system_name] = db_system['id']
-                        print(f"Mapped '{system_name}' to database system '{db_system['name']}' (ID: {db_system['id']})")
-                        found = True
-                        break
+            for variation in name_variations.get(system_name, ()):
+                db_system = by_name.get(variation.lower()) or by_alias.get(variation)
+                if db_system:
+                    break
 
             # If no variation match, try direct match
-            if not found:
-                for db_system in db_systems:
-                    if system_name.lower() == db_system['name'].lower() or \
-                       system_name.lower() == db_system['alias']:
-                        mapping[system_name] = db_system['id']
-                        print(f"Mapped '{system_name}' to database system '{db_system['name']}' (ID: {db_system['id']})")
-                        found = True
-                        break
+            if not db_system:
+                lowered_name = system_name.lower()
+                db_system = by_name.get(lowered_name) or by_alias.get(lowered_name)
+
+            if db_system:
+                mapping[system_name] = db_system['id']
+                print(f"Mapped '{system_name}' to database system '{db_system['name']}' (ID: {db_system['id']})")
+                continue
 
             # If still no match, try fuzzy matching
-            if not found:
-                print(f"Warning: No mapping found for system '{system_name}'")
-                db_system_names = [s['name'].lower() for s in db_systems]
-                matches = get_close_matches(system_name.lower(), db_system_names, n=1, cutoff=0.6)
-                if matches:
-                    for db_system in db_systems:
-                        if db_system['name'].lower() == matches[0]:
-                            mapping[system_name] = db_system['id']
-                            print(f"Fuzzy mapped '{system_name}' to database system '{db_system['name']}' (ID: {db_system['id']})")
-                            break
+            print(f"Warning: No mapping found for system '{system_name}'")
+            matches = get_close_matches(system_name.lower(), db_system_names, n=1, cutoff=0.6)
+            if matches:
+                db_system = by_name[matches[0]]
+                mapping[system_name] = db_system['id']
+                print(f"Fuzzy mapped '{system_name}' to database system '{db_system['name']}' (ID: {db_system['id']})")
 
         return mapping
 
-    def get_artwork_urls(self, game_id):
+    def get_title_index(self):
+        """Map platform ID -> lowercased game title -> game row"""
         cursor = self.db_conn.cursor()
-        cursor.execute("""
+        cursor.execute("SELECT id, game_title, platform FROM games ORDER BY id")
+
+        title_index = {}
+        for game in cursor:
+            titles = title_index.setdefault(game['platform'], {})
+            titles.setdefault(game['game_title'].lower(), game)
+
+        return title_index
+
+    def get_artwork_urls(self, game_id):
+        self.cursor.execute("""
             SELECT filename, type
             FROM game_artwork
             WHERE game_id = ?
             AND (type = 'boxart' OR type = 'screenshot')
             ORDER BY type, id
         """, (game_id,))
-        return cursor.fetchall()
+        return self.cursor.fetchall()
 
     def download_file(self, url, output_path):
+        # Download next to the target and rename once complete, so an
+        # interrupted run never leaves a truncated file that looks finished
+        part_path = output_path.with_name(output_path.name + '.part')
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 8192
-
-            with open(output_path, 'wb') as f, tqdm(
-                desc=output_path.name,
-                total=total_size,
-                unit='iB',
-                unit_scale=True
-            ) as pbar:
-                for data in response.iter_content(block_size):
-                    size = f.write(data)
-                    pbar.update(size)
-
-            # Small delay to prevent overwhelming the server
-            time.sleep(0.5)
+            # Closing the response hands its connection back to the pool, even on errors
+            with self.request_slots, self.session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+
+                # Copy the body in large blocks; run() reports progress per file
+                response.raw.decode_content = True
+                with open(part_path, 'wb') as f:
+                    shutil.copyfileobj(response.raw, f, COPY_BUFFER_SIZE)
+
+            os.replace(part_path, output_path)
             return True
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
             print(f"Error downloading {url}: {e}")
+            part_path.unlink(missing_ok=True)
             return False
 
-    def download_artwork_parallel(self, system_name, original_filename, game_title, artwork_urls, max_workers=4):
-        """Download artwork for a game using parallel downloads"""
+    def get_existing_files(self, base_path):
+        """Get the names of the files in a system folder, listing it only once"""
+        existing = self.existing_files.get(base_path)
+        if existing is None:
+            existing = set(os.listdir(base_path))
+            self.existing_files[base_path] = existing
+        return existing
+
+    def get_artwork_tasks(self, system_name, original_filename, artwork_urls):
+        """Get (url, output path) pairs for the artwork of a game that isn't downloaded yet"""
         base_path = Path("ROMs") / system_name
         base_path.mkdir(parents=True, exist_ok=True)
+        existing = self.get_existing_files(base_path)
 
         # Use original filename (minus extension) for the output files
         safe_title = os.path.splitext(original_filename)[0]
 
-        # Prepare download tasks
         download_tasks = []
         for url_data in artwork_urls:
             cdn_url = f"{GAMESDB_CDN}images/original/{url_data['filename']}"
 
             if url_data['type'] == 'boxart':
-                output_path = base_path / f"{safe_title}-cover.jpg"
+                artwork_name = f"{safe_title}-cover"
             else:  # screenshot
-                output_path = base_path / f"{safe_title}-screenshot.jpg"
+                artwork_name = f"{safe_title}-screenshot"
 
-            if not output_path.exists():
-                download_tasks.append((cdn_url, output_path))
+            # Skip artwork we already have in any format; names are matched exactly,
+            # as scan_roms.py does, so only artwork the index will show counts
+            if any(f"{artwork_name}{fmt}" in existing for fmt in ARTWORK_FORMATS):
+                continue
 
-        if not download_tasks:
-            return
+            download_tasks.append((cdn_url, base_path / f"{artwork_name}.jpg"))
 
-        # Download files in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(self.download_file, url, path)
-                      for url, path in download_tasks]
-            concurrent.futures.wait(futures)
+        return download_tasks
 
     def get_system_games(self, system_id):
         """Get all games for a given system"""
@@ -233,7 +307,7 @@ class ROMDownloader:
                         # Clean up the filename to match possible database names
                         game_name = os.path.splitext(child['name'])[0]  # Remove extension
                         game_name = game_name.replace('_', ' ')  # Replace underscores with spaces
-                        game_name = re.sub(r'\([^)]*\)', '', game_name)  # Remove parentheses and their contents
+                        game_name = _RE_PAREN.sub('', game_name)  # Remove parentheses and their contents
                         game_name = game_name.strip()
                         games_set.add(game_name.lower())
 
@@ -245,34 +319,16 @@ class ROMDownloader:
         name = os.path.splitext(name)[0]
 
         # Remove common suffixes in parentheses
-        name = re.sub(r'\s*\([^)]*\)\s*$', '', name)
+        name = _RE_TRAIL_PAREN.sub('', name)
 
         # Convert underscores to spaces
         name = name.replace('_', ' ')
 
         # Add spaces to camelCase words
-        name = re.sub(r'([a-z])([A-Z])', r'\1 \2', name)
-
-        # Remove platform-specific suffixes
-        suffixes = [
-            '-latest',
-            'by MooglyGuy (PD)',
-            '_Win64',
-            '(Nintendo, Wide Screen)',
-            '(VTech, Time & Fun)',
-            '(Gakken, LCD Card Game)',
-            '(Tomytronic)',
-            '(Nintendo, Panorama Screen)',
-            '(Nintendo, Table Top)',
-            '(Mattel Electronics)',
-            '(VTech, Electronic Tini-Arcade)',
-            '(VTech, Sporty Time & Fun)',
-            '(VTech, Explorer Time & Fun)',
-            '(Bandai, LSI Game Double Play)'
-        ]
-
-        for suffix in suffixes:
-            name = name.replace(suffix, '')
+        name = _RE_CAMEL.sub(r'\1 \2', name)
+
+        # Remove platform-specific suffixes in a single pass
+        name = _RE_SUFFIXES.sub('', name)
 
         # Clean up any multiple spaces
         name = ' '.join(name.split())
@@ -281,33 +337,26 @@ class ROMDownloader:
 
     def find_game_in_db(self, game_name, system_id):
         """Find a game in the database using exact match first, then fuzzy match"""
-        cursor = self.db_conn.cursor()
-        clean_name = self.clean_game_name(game_name)
+        titles = self.title_index.get(system_id, {})
+        clean_name = self.clean_game_name(game_name).lower()
 
         # Try exact match first
-        cursor.execute("""
-            SELECT id, game_title
-            FROM games
-            WHERE platform = ?
-            AND LOWER(game_title) = LOWER(?)
-        """, (system_id, clean_name))
+        game = titles.get(clean_name)
+        if game:
+            return game
 
-        result = cursor.fetchone()
-        if result:
-            return result
+        # If no exact match, try substring match
+        for title, game in titles.items():
+            if clean_name in title:
+                return game
 
-        # If no exact match, try LIKE match
-        cursor.execute("""
-            SELECT id, game_title
-            FROM games
-            WHERE platform = ?
-            AND LOWER(game_title) LIKE LOWER(?)
-        """, (system_id, f"%{clean_name}%"))
-
-        return cursor.fetchone()
+        return None
 
     def run(self):
         """Main execution method"""
+        # Output path -> URL; the first artwork found for a path wins
+        download_tasks = {}
+
         for system in self.cores_data:
             system_name = system['name']
             system_id = self.system_mapping.get(system_name)
@@ -330,17 +379,34 @@ class ROMDownloader:
                 if game:
                     artwork_urls = self.get_artwork_urls(game['id'])
                     if artwork_urls:
-                        # Pass both original filename and game title
-                        self.download_artwork_parallel(system_name, child['name'], game['game_title'], artwork_urls)
+                        # Name the artwork after the original filename
+                        for url, output_path in self.get_artwork_tasks(system_name, child['name'], artwork_urls):
+                            download_tasks.setdefault(output_path, url)
                     else:
                         print(f"No artwork found for: {game['game_title']}")
                 else:
                     print(f"Could not find game in database: {child['name']}")
 
-                # Small delay between games to prevent overwhelming the server
-                time.sleep(0.1)
+        if not download_tasks:
+            return
+
+        # Download everything through one pool so network latency overlaps across games
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        try:
+            futures = [executor.submit(self.download_file, url, path)
+                      for path, url in download_tasks.items()]
+            for _ in tqdm(concurrent.futures.as_completed(futures), total=len(futures),
+                          desc="Downloading artwork"):
+                pass
+        except BaseException:
+            # On Ctrl-C drop the queued downloads instead of working through all of them
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
 
     def __del__(self):
+        if hasattr(self, 'session'):
+            self.session.close()
         if hasattr(self, 'db_conn'):
             self.db_conn.close()
 
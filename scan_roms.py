@@ -1,13 +1,44 @@
 #!/usr/bin/env python3
+import argparse
 import os
 import json
-from pathlib import Path
-from typing import Dict, List
+import gzip
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ROM file extensions, compared lowercased
+ROM_EXTENSIONS = frozenset({'.zip', '.dosz'})
+
+# Supported artwork image formats, in order of preference
+IMAGE_FORMATS = ['.jpg', '.jpeg', '.png']
+
+# Version of the scan rules recorded in roms_mapping.meta.json; bump it whenever
+# what a scan produces changes (extensions, IMAGE_FORMATS, entry fields) so the
+# next run rescans every folder instead of reusing stale results
+SCAN_FORMAT_VERSION = 1
+
+# gzip level for index.html.gz; level 1 already gets most of the ratio on
+# repetitive markup for a fraction of the CPU time of the default 9
+GZIP_LEVEL = 1
 
-def generate_html(mapping: Dict, base_path: str) -> str:
-    """Generate HTML index of ROMs"""
-    html = f"""
+# Escapes text for HTML content and quoted attributes in a single pass
+HTML_ESCAPE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#39;',
+})
+
+# Static page prelude and closing tags; only the timestamp and ROM tables vary
+HTML_HEAD = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -15,9 +46,9 @@ def generate_html(mapping: Dict, base_path: str) -> str:
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1">
         <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; }}
-            .system {{ margin-bottom: 20px; }}
-            .system-header {{
+            body { font-family: Arial, sans-serif; margin: 20px; }
+            .system { margin-bottom: 20px; }
+            .system-header {
                 background: #f0f0f0;
                 padding: 10px;
                 cursor: pointer;
@@ -25,60 +56,79 @@ def generate_html(mapping: Dict, base_path: str) -> str:
                 display: flex;
                 justify-content: space-between;
                 align-items: center;
-            }}
-            .system-header:hover {{ background: #e0e0e0; }}
-            .system-content {{
+            }
+            .system-header:hover { background: #e0e0e0; }
+            .system-content {
                 display: block;
                 margin-left: 20px;
                 overflow-x: auto;
-            }}
-            .caret {{
+            }
+            .caret {
                 transition: transform 0.2s;
                 font-size: 20px;
-            }}
-            .collapsed .caret {{
+            }
+            .collapsed .caret {
                 transform: rotate(-90deg);
-            }}
-            .collapsed + .system-content {{
+            }
+            .collapsed + .system-content {
                 display: none;
-            }}
-            .rom-row {{
+            }
+            .rom-row {
                 display: flex;
                 align-items: center;
                 padding: 10px;
                 border-bottom: 1px solid #eee;
-            }}
-            .rom-info {{ flex: 1; }}
-            .artwork {{
+            }
+            .rom-info { flex: 1; }
+            .artwork {
                 max-width: 100px;
                 max-height: 100px;
                 margin: 0 10px;
-            }}
-            table {{ border-collapse: collapse; width: 100%; }}
-            th, td {{
+            }
+            table { border-collapse: collapse; width: 100%; }
+            th, td {
                 padding: 8px;
                 text-align: left;
                 border-bottom: 1px solid #ddd;
-            }}
-            th {{ background-color: #f5f5f5; }}
-            .size {{ color: #666; }}
-            .timestamp {{ color: #999; font-size: 0.8em; }}
+            }
+            th { background-color: #f5f5f5; }
+            .size { color: #666; }
+            .timestamp { color: #999; font-size: 0.8em; }
         </style>
         <script>
-            function toggleSystem(systemId) {{
-                const header = document.querySelector(`[data-system="${{systemId}}"]`);
+            function toggleSystem(systemId) {
+                const header = document.querySelector(`[data-system="${systemId}"]`);
                 header.classList.toggle('collapsed');
-            }}
+            }
         </script>
     </head>
     <body>
-        <h1>ROMs Index</h1>
-        <p class="timestamp">Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+        <h1>ROMs Index</h1>"""
+
+HTML_TAIL = """
+    </body>
+    </html>
     """
 
-    for system_name, system_data in sorted(mapping.items()):
+def generate_html(mapping: Dict, base_path: str, *, generated_at: str) -> str:
+    """Generate HTML index of ROMs, stamped with the given generation time"""
+    # Collect chunks and join once; += on a str copies the whole page every time
+    parts = [
+        HTML_HEAD,
+        f"""
+        <p class="timestamp">Generated on {generated_at}</p>
+    """,
+    ]
+
+    # Sort just the names; sorting the items would build and compare (key, value) tuples
+    for system_name in sorted(mapping):
+        system_data = mapping[system_name]
+
+        # Folder and file names are user-supplied, escape them before they go into markup
+        system_name = system_name.translate(HTML_ESCAPE)
         system_id = system_name.replace('.', '_')
-        html += f"""
+        rom_prefix = f"ROMs/{system_name}/"
+        parts.append(f"""
         <div class="system">
             <div class="system-header" data-system="{system_id}" onclick="toggleSystem('{system_id}')">
                 <span>📁 {system_name} ({system_data['count']} ROMs)</span>
@@ -91,110 +141,202 @@ def generate_html(mapping: Dict, base_path: str) -> str:
                         <th>Size</th>
                         <th>Artwork</th>
                     </tr>
-        """
+        """)
 
         for rom in system_data['roms']:
-            size_kb = rom['size'] / 1024
-            size_mb = size_kb / 1024
-            size_str = f"{size_mb:.2f} MB" if size_mb >= 1 else f"{size_kb:.2f} KB"
+            size = rom['size']
+            if size >= 1048576:
+                size_str = f"{size / 1048576:.2f} MB"
+            else:
+                size_str = f"{size / 1024:.2f} KB"
 
-            rom_path = f"ROMs/{system_name}/{rom['file']}"
+            rom_file = rom['file'].translate(HTML_ESCAPE)
+            rom_path = f"{rom_prefix}{rom_file}"
             artwork_html = ""
 
-            if 'artwork' in rom:
-                if 'cover' in rom['artwork']:
-                    cover_path = f"ROMs/{system_name}/{rom['artwork']['cover']}"
+            artwork = rom.get('artwork')
+            if artwork:
+                cover = artwork.get('cover')
+                if cover:
+                    cover_path = f"{rom_prefix}{cover.translate(HTML_ESCAPE)}"
                     artwork_html += f'<a href="{cover_path}"><img src="{cover_path}" class="artwork" alt="Cover" title="Cover"></a>'
-                if 'screenshot' in rom['artwork']:
-                    screenshot_path = f"ROMs/{system_name}/{rom['artwork']['screenshot']}"
+                screenshot = artwork.get('screenshot')
+                if screenshot:
+                    screenshot_path = f"{rom_prefix}{screenshot.translate(HTML_ESCAPE)}"
                     artwork_html += f'<a href="{screenshot_path}"><img src="{screenshot_path}" class="artwork" alt="Screenshot" title="Screenshot"></a>'
 
-            html += f"""
+            parts.append(f"""
                     <tr>
-                        <td><a href="{rom_path}">{rom['file']}</a></td>
+                        <td><a href="{rom_path}">{rom_file}</a></td>
                         <td class="size">{size_str}</td>
                         <td>{artwork_html}</td>
                     </tr>
-            """
+            """)
 
-        html += """
+        parts.append("""
                 </table>
             </div>
         </div>
-        """
+        """)
 
-    html += """
-    </body>
-    </html>
-    """
+    parts.append(HTML_TAIL)
 
-    return html
+    return "".join(parts)
 
-def scan_roms_folder(base_path: str) -> Dict:
-    """Scan ROMs folder and generate mapping of contents"""
-    base = Path(base_path)
+def scan_system_folder(system_dir: os.DirEntry) -> Dict:
+    """Scan a single system folder for ROMs and their artwork"""
+    roms_list = []
+    rom_count = 0
+
+    # List the system folder once: ROM entries plus every name for artwork lookups
+    rom_entries = []
+    names = set()
+    with os.scandir(system_dir.path) as entries:
+        for entry in entries:
+            name = entry.name
+            names.add(name)
+
+            # Process ROM files (zip and dosz files); a bare ".zip" has no name
+            dot = name.rfind('.')
+            if dot > 0 and name[dot:].lower() in ROM_EXTENSIONS:
+                rom_entries.append((name.lower(), name, name[:dot], entry))
+
+    # Sort roms alphabetically by filename while they're still plain tuples,
+    # the exact name breaks ties between names that differ only in case
+    rom_entries.sort()
+
+    for _, name, rom_base, entry in rom_entries:
+        rom_count += 1
+        rom_info = {
+            "file": name,
+            "size": entry.stat().st_size
+        }
+
+        # Check for artwork in different formats
+        artwork = {}
+
+        # Check for cover art
+        for fmt in IMAGE_FORMATS:
+            cover_name = f"{rom_base}-cover{fmt}"
+            if cover_name in names:
+                artwork["cover"] = cover_name
+                break
+
+        # Check for screenshot
+        for fmt in IMAGE_FORMATS:
+            screenshot_name = f"{rom_base}-screenshot{fmt}"
+            if screenshot_name in names:
+                artwork["screenshot"] = screenshot_name
+                break
+
+        if artwork:
+            rom_info["artwork"] = artwork
+
+        roms_list.append(rom_info)
+
+    return {
+        "count": rom_count,
+        "roms": roms_list
+    }
+
+def refresh_system_folder(system_dir: os.DirEntry, system_data: Dict) -> Optional[Dict]:
+    """Update the ROM sizes of a folder scanned on a previous run, or None if it needs a full scan"""
+    roms_list = []
+    for rom in system_data["roms"]:
+        try:
+            size = os.stat(os.path.join(system_dir.path, rom["file"])).st_size
+        except OSError:
+            return None
+        roms_list.append({**rom, "size": size})
+
+    return {
+        "count": system_data["count"],
+        "roms": roms_list
+    }
+
+def update_system_folder(system_dir: os.DirEntry, previous_data: Optional[Dict]) -> Dict:
+    """Refresh a folder's results from the last run when given them, otherwise scan it"""
+    if previous_data is not None:
+        system_data = refresh_system_folder(system_dir, previous_data)
+        if system_data is not None:
+            return system_data
+
+    return scan_system_folder(system_dir)
+
+def scan_roms_folder(base_path: str, previous: Dict = None, previous_fingerprints: Dict = None) -> Tuple[Dict, Dict]:
+    """Scan ROMs folder and generate mapping of contents, plus per-system fingerprints"""
+    previous = previous or {}
+    previous_fingerprints = previous_fingerprints or {}
     mapping = {}
+    fingerprints = {}
 
-    # Define supported image formats
-    image_formats = ['.jpg', '.jpeg', '.png']
-
-    # Scan each system folder
-    for system_dir in base.iterdir():
-        if not system_dir.is_dir():
-            continue
-
-        system_name = system_dir.name
-        roms_list = []
-        rom_count = 0
-
-        # Scan contents of system folder
-        for file_path in system_dir.iterdir():
-            # Process ROM files (zip and dosz files)
-            if file_path.suffix.lower() not in ['.zip', '.dosz']:
-                continue
-
-            rom_count += 1
-            rom_base = file_path.stem
-            rom_info = {
-                "file": file_path.name,
-                "size": file_path.stat().st_size
-            }
+    with os.scandir(base_path) as entries:
+        system_dirs = [entry for entry in entries if entry.is_dir()]
 
-            # Check for artwork in different formats
-            artwork = {}
+    # A folder's mtime and size change whenever files are added, removed or renamed
+    # in it, so folders that still match the last run can reuse its file list and
+    # artwork. Overwriting a ROM in place doesn't touch the folder, so their ROM
+    # sizes are still read again.
+    previous_data = []
+    for system_dir in system_dirs:
+        dir_stat = system_dir.stat()
+        fingerprint = [dir_stat.st_mtime_ns, dir_stat.st_size]
+        fingerprints[system_dir.name] = fingerprint
 
-            # Check for cover art
-            for fmt in image_formats:
-                cover_path = file_path.with_name(f"{rom_base}-cover{fmt}")
-                if cover_path.exists():
-                    artwork["cover"] = cover_path.name
-                    break
+        if previous_fingerprints.get(system_dir.name) == fingerprint:
+            previous_data.append(previous.get(system_dir.name))
+        else:
+            previous_data.append(None)
 
-            # Check for screenshot
-            for fmt in image_formats:
-                screenshot_path = file_path.with_name(f"{rom_base}-screenshot{fmt}")
-                if screenshot_path.exists():
-                    artwork["screenshot"] = screenshot_path.name
-                    break
+    # Refresh or scan system folders in parallel; the work is mostly waiting on
+    # the filesystem. map() keeps listing order so the output doesn't depend on timing.
+    max_workers = max(1, min(32, len(system_dirs)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(update_system_folder, system_dirs, previous_data)
 
-            if artwork:
-                rom_info["artwork"] = artwork
+        for system_dir, system_data in zip(system_dirs, results):
+            # Add system to mapping if it has ROMs
+            if system_data["count"] > 0:
+                mapping[system_dir.name] = system_data
 
-            roms_list.append(rom_info)
+    return mapping, fingerprints
 
-        # Sort roms alphabetically by filename
-        roms_list.sort(key=lambda x: x['file'].lower())
+def load_previous_scan(output_file: str, meta_file: str) -> Tuple[Dict, Dict]:
+    """Load the last run's mapping and folder fingerprints, if both are present and current"""
+    try:
+        with open(output_file, 'rb') as f:
+            previous = load_json(f.read())
+        with open(meta_file, 'rb') as f:
+            meta = load_json(f.read())
+    except (OSError, ValueError):
+        return {}, {}
 
-        # Add system to mapping if it has ROMs
-        if rom_count > 0:
-            mapping[system_name] = {
-                "count": rom_count,
-                "roms": roms_list
-            }
+    # Results from other scan rules can't be reused
+    if not isinstance(meta, dict) or meta.get("version") != SCAN_FORMAT_VERSION:
+        return {}, {}
+
+    return previous, meta.get("folders", {})
+
+def load_json(data: bytes):
+    """Parse JSON, using orjson when it's installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-    return mapping
+def dump_mapping(mapping: Dict) -> bytes:
+    """Serialize the mapping as indented JSON, using orjson when it's installed"""
+    if orjson is not None:
+        return orjson.dumps(mapping, option=orjson.OPT_INDENT_2)
+    return json.dumps(mapping, indent=2, ensure_ascii=False).encode('utf-8')
 
 def main():
+    parser = argparse.ArgumentParser(description='Scan the ROMs folder and generate roms_mapping.json and index.html')
+    parser.add_argument('--gzip', action='store_true',
+                       help='Also write a precompressed index.html.gz')
+    parser.add_argument('--rescan', action='store_true',
+                       help='Scan every system folder instead of reusing unchanged ones from the last run')
+    args = parser.parse_args()
+
     # Assuming ROMs folder is in current directory
     roms_path = "ROMs"
 
@@ -202,18 +344,30 @@ def main():
         print(f"Error: {roms_path} directory not found")
         return
 
+    # Folders unchanged since the last run are taken from the previous mapping
+    output_file = "roms_mapping.json"
+    meta_file = "roms_mapping.meta.json"
+    if args.rescan:
+        previous, previous_fingerprints = {}, {}
+    else:
+        previous, previous_fingerprints = load_previous_scan(output_file, meta_file)
+
     print(f"Scanning {roms_path}...")
-    mapping = scan_roms_folder(roms_path)
+    mapping, fingerprints = scan_roms_folder(roms_path, previous, previous_fingerprints)
 
     # Write to JSON file
-    output_file = "roms_mapping.json"
-    with open(output_file, 'w') as f:
-        json.dump(mapping, f, indent=2)
+    Path(output_file).write_bytes(dump_mapping(mapping))
+
+    # Generate and write HTML index, as UTF-8 whatever the platform's default encoding
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    html = generate_html(mapping, roms_path, generated_at=generated_at).encode('utf-8')
+    Path('index.html').write_bytes(html)
+
+    if args.gzip:
+        Path('index.html.gz').write_bytes(gzip.compress(html, compresslevel=GZIP_LEVEL))
 
-    # Generate and write HTML index
-    html_content = generate_html(mapping, roms_path)
-    with open('index.html', 'w') as f:
-        f.write(html_content)
+    meta = {"version": SCAN_FORMAT_VERSION, "folders": fingerprints}
+    Path(meta_file).write_bytes(json.dumps(meta).encode('utf-8'))
 
     # Print summary
     total_roms = sum(system["count"] for system in mapping.values())
@@ -221,6 +375,8 @@ def main():
     print(f"\nFound {total_roms} ROMs across {total_systems} systems")
     print(f"Mapping written to {output_file}")
     print(f"HTML index written to index.html")
+    if args.gzip:
+        print(f"Compressed HTML index written to index.html.gz")
 
 if __name__ == "__main__":
     main()